@@ -6,6 +6,7 @@ import os
 import functools
 import collections
 import multiprocessing
+import weakref
 
 def switch(condition, then_expression, else_expression):
     """Switches between two operations depending on a scalar value (int or bool).
@@ -56,7 +57,7 @@ def get_session(config=None):
         sess = make_session(config=config, make_default=True)
     return sess
 
-def make_session(config=None, num_cpu=None, make_default=False, graph=None):
+def make_session(config=None, num_cpu=None, make_default=False, graph=None, use_gpu=True):
     """Returns a session that will use <num_cpu> CPU's only"""
     '''
     if num_cpu is None:
@@ -71,8 +72,11 @@ def make_session(config=None, num_cpu=None, make_default=False, graph=None):
     '''
     if config is None:
         config = tf.ConfigProto(
-            device_count = {'GPU':1}
+            device_count = {'GPU':1 if use_gpu else 0}
         )
+        if num_cpu is not None:
+            config.inter_op_parallelism_threads = num_cpu
+            config.intra_op_parallelism_threads = num_cpu
         config.gpu_options.allow_growth = True
     if make_default:
         return tf.InteractiveSession(config=config, graph=graph)
@@ -318,15 +322,30 @@ def get_available_gpus():
 # Saving variables
 # ================================================================
 
+_SAVERS = weakref.WeakKeyDictionary()  # graph -> (variable names, saver)
+
+def _get_saver():
+    # tf.train.Saver() adds save/restore ops to the graph, so building one per call grows
+    # the graph on every checkpoint. Keep one Saver per graph (dropped with the graph) and
+    # rebuild it only when the variable set has changed. max_to_keep=None keeps every
+    # iter_N checkpoint, as the old one-Saver-per-save code did; the default of 5 would
+    # delete older iterations that --load_iter may still ask for
+    graph = tf.get_default_graph()
+    var_names = tuple(v.name for v in tf.global_variables())
+    cached = _SAVERS.get(graph)
+    if cached is None or cached[0] != var_names:
+        cached = _SAVERS[graph] = (var_names, tf.train.Saver(max_to_keep=None))
+    return cached[1]
+
 def load_state(fname, sess=None):
     sess = sess or get_session()
-    saver = tf.train.Saver()
+    saver = _get_saver()
     saver.restore(tf.get_default_session(), fname)
 
 def save_state(fname, sess=None):
     sess = sess or get_session()
     os.makedirs(os.path.dirname(fname), exist_ok=True)
-    saver = tf.train.Saver()
+    saver = _get_saver()
     saver.save(tf.get_default_session(), fname)
 
 # The methods above and below are clearly doing the same thing, and in a rather similar way
@@ -5,6 +5,7 @@ import rospy
 import time
 import gym
 from gym import spaces
+from gym.utils import seeding
 
 from gazebo_msgs.msg import ModelState
 from gazebo_msgs.msg import ContactsState
@@ -16,13 +17,18 @@ from std_srvs.srv import Empty
 from gazebo_msgs.srv import GetModelState
 from gazebo_msgs.srv import SetModelState
 from gazebo_msgs.srv import ApplyBodyWrench
-from tf.transformations import euler_from_quaternion, quaternion_from_euler
+from gazebo_msgs.srv import BodyRequest
+from tf.transformations import quaternion_from_euler
 
 
-from utils import board_to_world, init_quad, apply_wrench_to_quad
+from utils import board_to_world, init_quad, apply_wrench_to_quad, quaternion_to_euler
 
 from brs_engine.FullQuad_brs_engine import *
 
+# bounds of the random initial state: [x, y, z, roll_w, pitch_w, yaw_w]
+SPAWN_LOW = np.array([-2, -2, 3, -np.pi/6, -np.pi/6, -np.pi/6])
+SPAWN_HIGH = np.array([2, 2, 7, np.pi/6, np.pi/6, np.pi/6])
+
 
 class QuadFallingDownEnv_v0(gym.Env):
     def __init__(self, **kwargs):
@@ -31,38 +37,77 @@ class QuadFallingDownEnv_v0(gym.Env):
         self.weight = self.mass * 9.81
         self.max_lift = 0.058 * 9.81
 
+        # it's not feasible to set the lower limit to the weight of quad since sometimes we may require one of the motor to be zero for highly rolling or something
+        self._action_space = spaces.Box(low=0, high=self.max_lift/4., shape=(4,))
+        # affine map from the policy output range [-1,1] to the motor thrust limits, and a buffer to write it into
+        self._ac_scale = (self._action_space.high - self._action_space.low) / 2.
+        self._ac_bias = (self._action_space.high + self._action_space.low) / 2.
+        self._env_ac = np.empty(self._action_space.shape)
+        # observations are float32 to match the policy's ob placeholder, so they are fed without a cast
+        self._observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(15,), dtype=np.float32)
+        self.seed()
+
         # self.step_counter = 0
         # self.max_steps = 100
 
         self.collision_reward = -400
         self.goal_reward = 1000
 
+        # goal region limits on |roll|, |pitch| (rad) and |roll_w|, |pitch_w| (rad/s)
+        self.goal_angle = 0.348
+        self.goal_rate = 0.17
+
         self.reward_type = kwargs['reward_type']
         self.brs_engine = None
         if self.reward_type == 'ttr':
             self.brs_engine = FullQuad_brs_engine()
-        print(self.reward_type)
-        print(self.brs_engine)
 
         self.high_level_goal = False
 
         rospy.init_node("quad_falling_down", anonymous=True, log_level=rospy.INFO)
-        self.unpause = rospy.ServiceProxy('/gazebo/unpause_physics', Empty)
-        self.pause = rospy.ServiceProxy('/gazebo/pause_physics', Empty)
-        self.reset_proxy = rospy.ServiceProxy('/gazebo/reset_simulation', Empty)
-        self.get_model_state = rospy.ServiceProxy('/gazebo/get_model_state', GetModelState)
+        # services called on every step are waited for once here and kept as persistent
+        # connections, instead of a master lookup and a new TCP handshake per call
+        for srv in ['/gazebo/unpause_physics', '/gazebo/pause_physics', '/gazebo/get_model_state', '/gazebo/apply_body_wrench']:
+            rospy.wait_for_service(srv)
+        self.unpause = rospy.ServiceProxy('/gazebo/unpause_physics', Empty, persistent=True)
+        self.pause = rospy.ServiceProxy('/gazebo/pause_physics', Empty, persistent=True)
+        # reset_world only restores model poses; reset_simulation also rewinds the clock and resets
+        # every sensor and plugin, which is wasted work since reset() then sets the quadrotor state itself
+        self.reset_proxy = rospy.ServiceProxy('/gazebo/reset_world', Empty)
+        self.get_model_state = rospy.ServiceProxy('/gazebo/get_model_state', GetModelState, persistent=True)
         self.set_model_state = rospy.ServiceProxy('/gazebo/set_model_state', SetModelState)
 
-        self.apply_wrench = rospy.ServiceProxy('/gazebo/apply_body_wrench', ApplyBodyWrench)
+        self.apply_wrench = rospy.ServiceProxy('/gazebo/apply_body_wrench', ApplyBodyWrench, persistent=True)
+        self.clear_wrenches = rospy.ServiceProxy('/gazebo/clear_body_wrenches', BodyRequest)
+
+    def reconnect(self, attr):
+        # rospy never re-opens a persistent proxy once its connection has failed, so every
+        # later call would fail too; drop it and open a fresh connection to the same service.
+        # Callers retry once on the new proxy and let a second failure propagate
+        proxy = getattr(self, attr)
+        proxy.close()
+        rospy.wait_for_service(proxy.resolved_name)
+        setattr(self, attr, rospy.ServiceProxy(proxy.resolved_name, proxy.service_class, persistent=True))
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
 
     def reset(self, reset_args=None):
-        rospy.wait_for_service('/gazebo/reset_simulation')
+        rospy.wait_for_service('/gazebo/reset_world')
+        rospy.wait_for_service('/gazebo/clear_body_wrenches')
         try:
             self.reset_proxy()
+            # each applied wrench lasts longer than a step and reset_world does not rewind the
+            # clock, so drop the previous episode's pending wrenches before spawning again
+            self.clear_wrenches(body_name="quadrotor::base_link")
+            # draw the whole random part of the initial state in one call
+            x, y, z, roll_w, pitch_w, yaw_w = self.np_random.uniform(low=SPAWN_LOW, high=SPAWN_HIGH)
+
             # initialize pose
             pose = Pose()
-            pose.position.x, pose.position.y = np.random.uniform(low=-2, high=2), np.random.uniform(low=-2, high=2)
-            pose.position.z = np.random.uniform(3,7)
+            pose.position.x, pose.position.y = x, y
+            pose.position.z = z
 
             # Note: gazebo rotation order: roll, pitch, yaw
             # the angle w.r.t x-axis: roll in gazebo
@@ -87,9 +132,6 @@ class QuadFallingDownEnv_v0(gym.Env):
             vx = 0.4
             vy = 0.4
             vz = 0.4
-            roll_w = np.random.uniform(-np.pi/6, np.pi/6)
-            pitch_w = np.random.uniform(-np.pi/6, np.pi/6)
-            yaw_w = np.random.uniform(-np.pi/6, np.pi/6)
             # roll_w = 0
             # pitch_w = 0
             # yaw_w = 0
@@ -105,7 +147,7 @@ class QuadFallingDownEnv_v0(gym.Env):
             self.set_model_state(reset_state)
 
         except rospy.ServiceException as e:
-            print("# /gazebo/reset_simulation call failed")
+            print("# /gazebo/reset_world call failed")
 
         # Unpause simulation to make observation
         rospy.wait_for_service('/gazebo/unpause_physics')
@@ -113,6 +155,8 @@ class QuadFallingDownEnv_v0(gym.Env):
             self.unpause()
         except rospy.ServiceException as e:
             print("/gazebo/unpause_physics service call failed")
+            self.reconnect('unpause')
+            self.unpause()
 
         # read observation
         dynamic_data = None
@@ -121,13 +165,16 @@ class QuadFallingDownEnv_v0(gym.Env):
             try:
                 dynamic_data = self.get_model_state(model_name="quadrotor")
             except rospy.ServiceException as e:
-                print("/gazebo/unpause_physics service call failed")
+                print("/gazebo/get_model_state service call failed")
+                self.reconnect('get_model_state')
 
         rospy.wait_for_service('/gazebo/pause_physics')
         try:
             self.pause()
         except rospy.ServiceException as e:
             print("/gazebo/pause_physics service call failed!")
+            self.reconnect('pause')
+            self.pause()
 
         obsrv = self.get_obsrv(dynamic_data)
         self.pre_obsrv = obsrv
@@ -138,18 +185,13 @@ class QuadFallingDownEnv_v0(gym.Env):
     def step(self, action):
         # action is 4-dims representing drone's four thrusts
         # --- check if the output of policy network is nan --- 
-        if sum(np.isnan(action)) > 0:
+        if np.isnan(action).any():
             raise ValueError("Passed in nan to step! Action: " + str(action))
         
         # --- transform action from network output into environment limit, use ref=[-2,2] ---
-        # print("action before clipped:", action)
-        ref_action = spaces.Box(low=-1, high=1, shape=(4,))
-        env_action = self.action_space.low + (self.action_space.high - self.action_space.low) * (action - ref_action.low) * 1.0 / (ref_action.high - ref_action.low)
-        # print("env_action:", env_action)
-        clipped_env_ac = np.clip(env_action.copy(), self.action_space.low, self.action_space.high) 
-        
-        # print("action after clipped:", clipped_env_ac)
-        
+        env_action = np.multiply(action, self._ac_scale, out=self._env_ac)
+        np.add(env_action, self._ac_bias, out=env_action)
+        clipped_env_ac = np.clip(env_action, self._action_space.low, self._action_space.high, out=env_action)
 
         # --- apply action to quadcoptor ---
         pre_roll = self.pre_obsrv[4]
@@ -159,38 +201,40 @@ class QuadFallingDownEnv_v0(gym.Env):
         pre_roll_w = self.pre_obsrv[7]
         pre_pitch_w = self.pre_obsrv[8]
 
-        # print("roll_w:", pre_roll_w)
-        # print("pitch_w:", pre_pitch_w)
-
-        rospy.wait_for_service('/gazebo/apply_body_wrench')
-        _ = apply_wrench_to_quad(self.apply_wrench, clipped_env_ac, pre_roll, pre_pitch, pre_yaw)
+        try:
+            _ = apply_wrench_to_quad(self.apply_wrench, clipped_env_ac, pre_roll, pre_pitch, pre_yaw)
+        except rospy.ServiceException as e:
+            print("/gazebo/apply_body_wrench service call failed")
+            self.reconnect('apply_wrench')
+            _ = apply_wrench_to_quad(self.apply_wrench, clipped_env_ac, pre_roll, pre_pitch, pre_yaw)
 
         # --- run simulator to collect data ---
-        rospy.wait_for_service('/gazebo/unpause_physics')
         try:
             self.unpause()
         except rospy.ServiceException as e:
             print("/gazebo/unpause_physics service call failed")
+            self.reconnect('unpause')
+            self.unpause()
 
         dynamic_data = None
         contact_data = None
-        while dynamic_data is None and contact_data is None:
-            rospy.wait_for_service('/gazebo/get_model_state')
+        while dynamic_data is None or contact_data is None:
             try:
                 contact_data = rospy.wait_for_message('/gazebo_ros_bumper', ContactsState, timeout=50)
                 dynamic_data = self.get_model_state(model_name="quadrotor")
             except rospy.ServiceException as e:
                 print("/gazebo/get_model_state service call failed!")
+                self.reconnect('get_model_state')
 
-        rospy.wait_for_service('/gazebo/pause_physics')
         try:
             self.pause()
         except rospy.ServiceException as e:
             print("/gazebo/pause_physics service call failed")
+            self.reconnect('pause')
+            self.pause()
         
         # --- deal wiht obsrv and reward assignment ---
         obsrv = self.get_obsrv(dynamic_data)
-        # print("obsrv:", obsrv)
         self.pre_obsrv = obsrv
 
         reward = 0
@@ -206,11 +250,11 @@ class QuadFallingDownEnv_v0(gym.Env):
             pass
 
         # --- additional rewards on angular velocity ---
-        if -0.17 <= pre_roll_w <= 0.17 and -0.17 <= pre_pitch_w <= 0.17:
+        w = self.goal_rate
+        if -w <= pre_roll_w <= w and -w <= pre_pitch_w <= w:
             reward += 0
         else:
-            tmp_reward_w = -1.0 * (abs(pre_roll_w - (-0.17)) + abs(pre_roll_w - 0.17) + abs(pre_pitch_w - (-0.17)) + abs(pre_pitch_w - 0.17))
-            # print("penalty only for angular velocity:", tmp_reward_w)
+            tmp_reward_w = -1.0 * (abs(pre_roll_w + w) + abs(pre_roll_w - w) + abs(pre_pitch_w + w) + abs(pre_pitch_w - w))
             reward += tmp_reward_w
         # ----------------------------------------------
 
@@ -222,58 +266,63 @@ class QuadFallingDownEnv_v0(gym.Env):
             done = True
 
         # --- one-level reward setting ---
-        # if self.in_goal(obsrv):
+        # if self.goal_level(obsrv) == 2:
             # reward += self.goal_reward
             # done = True
             # suc  = True
         # -----------------------------------
 
         # --- two-level reward setting ---
-        if self.in_goal(obsrv):
+        goal_level = self.goal_level(obsrv)
+        if goal_level == 2:
             reward += self.goal_reward
             done = True
             suc  = True
-        elif self.in_half_goal(obsrv):
+        elif goal_level == 1:
             reward += self.goal_reward / 2.
         else:
             pass
         # -------------------------------
 
-        # print("reward:", reward)
         #if self.out_of_time():
         #    print("episode out of max length")
         #    done = True
 
         # self.step_counter += 1
-        # print("reward:%f" %reward)
 
-        return np.array(np.copy(obsrv)), reward, done, suc, {}
+        return obsrv, reward, done, suc, {}
 
     def get_obsrv(self, dynamic_data):
+        # read each sub-message of the GetModelState response once
+        position = dynamic_data.pose.position
+        orientation = dynamic_data.pose.orientation
+        linear = dynamic_data.twist.linear
+        angular = dynamic_data.twist.angular
+        x, y, z = position.x, position.y, position.z
+
         # we don't include any state variables w.r.t 2D positions (x,y)
         # But we include the distance to walls around
-        d_front = 5.0 - dynamic_data.pose.position.y 
-        d_rear  = 5.0 + dynamic_data.pose.position.y
-        d_left  = 5.0 + dynamic_data.pose.position.x
-        d_right = 5.0 - dynamic_data.pose.position.x
-        d_top   = 10  - dynamic_data.pose.position.z
-        z = dynamic_data.pose.position.z
-        vx =  dynamic_data.twist.linear.x
-        vy =  dynamic_data.twist.linear.y
-        vz =  dynamic_data.twist.linear.z
+        d_front = 5.0 - y
+        d_rear  = 5.0 + y
+        d_left  = 5.0 + x
+        d_right = 5.0 - x
+        d_top   = 10  - z
+        vx = linear.x
+        vy = linear.y
+        vz = linear.z
 
-        roll_w = dynamic_data.twist.angular.x
-        pitch_w = dynamic_data.twist.angular.y
-        yaw_w = dynamic_data.twist.angular.z
+        roll_w = angular.x
+        pitch_w = angular.y
+        yaw_w = angular.z
 
-        ox = dynamic_data.pose.orientation.x
-        oy = dynamic_data.pose.orientation.y
-        oz = dynamic_data.pose.orientation.z
-        ow = dynamic_data.pose.orientation.w
+        ox = orientation.x
+        oy = orientation.y
+        oz = orientation.z
+        ow = orientation.w
 
-        roll, pitch, yaw = euler_from_quaternion([ox, oy, oz, ow])
+        roll, pitch, yaw = quaternion_to_euler(ox, oy, oz, ow)
 
-        return np.array([z, vx, vy, vz, roll, pitch, yaw, roll_w, pitch_w, yaw_w, d_front, d_rear, d_left, d_right, d_top])
+        return np.array([z, vx, vy, vz, roll, pitch, yaw, roll_w, pitch_w, yaw_w, d_front, d_rear, d_left, d_right, d_top], dtype=np.float32)
 
     def in_obst(self, contact_data):
 
@@ -283,42 +332,20 @@ class QuadFallingDownEnv_v0(gym.Env):
         else:
                 return False
 
-    def in_goal(self, obsrv):
-        pitch = obsrv[5]
-        roll = obsrv[4]
-        pitch_w = obsrv[8]
-        roll_w = obsrv[7]
-        vx = obsrv[1]
-        vy = obsrv[2]
-        vz = obsrv[3]
-        
-        if -0.348 <= pitch <= 0.348 and -0.348 <= roll <= 0.348 and -0.17 <= pitch_w <= 0.17 and -0.17 <= roll_w <= 0.17:
+    def goal_level(self, obsrv):
+        # 2: goal (small attitude and body rates), 1: half goal (small body rates only), 0: neither.
+        # the body-rate test is shared by both levels, so it is evaluated once
+        w = self.goal_rate
+        if not (-w <= obsrv[8] <= w and -w <= obsrv[7] <= w):
+            return 0
+
+        a = self.goal_angle
+        if -a <= obsrv[5] <= a and -a <= obsrv[4] <= a:
             print("reach goal!!")
-            return True
+            return 2
         else:
-            return False
-        '''
-        if -0.348 <= pitch <= 0.348 and -0.348 <= roll <= 0.348 and -0.17 <= pitch_w <= 0.17 and -0.17 <= roll_w <= 0.17 and -0.1 <= vx <= 0.1 and -0.1 <= vy <= 0.1 and -0.1 <= vz <= 0.1:
-            print("reach the goal!!")
-            return True
-        else:
-            return False
-        '''
-
-    def in_half_goal(self, obsrv):
-        pitch = obsrv[5]
-        roll = obsrv[4]
-        pitch_w = obsrv[8]
-        roll_w = obsrv[7]
-        vx = obsrv[1]
-        vy = obsrv[2]
-        vz = obsrv[3]
-        
-        if (-0.17 <= pitch_w <= 0.17 and -0.17 <= roll_w <= 0.17):
             print("reach half goal!")
-            return True
-        else:
-            return False
+            return 1
 
     def out_of_time(self):
         if self.step_counter > self.max_steps:
@@ -330,9 +357,8 @@ class QuadFallingDownEnv_v0(gym.Env):
     # observation space: [z,vx,vy,vz,roll,pitch,yaw,roll_rate,pitch_rate,yaw_rate]
     @property
     def observation_space(self):
-        return spaces.Box(low=-np.inf, high=np.inf, shape=(15,))
+        return self._observation_space
 
     @property
     def action_space(self):
-        # it's not feasible to set the lower limit to the weight of quad since sometimes we may require one of the motor to be zero for highly rolling or something
-        return spaces.Box(low=0, high=self.max_lift/4., shape=(4,))
+        return self._action_space
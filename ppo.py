@@ -6,8 +6,8 @@ import numpy as np
 from collections import Counter
 
 
-def create_session(num_cpu=None):
-    U.make_session(num_cpu=num_cpu).__enter__()
+def create_session(num_cpu=None, use_gpu=True):
+    U.make_session(num_cpu=num_cpu, use_gpu=use_gpu).__enter__()
 
 
 def create_policy(name, env):
@@ -27,12 +27,14 @@ def traj_segment_generator(pi, env, horizon, stochastic):
     # start_rews = defaultdict(list)
 
     # Initialize history arrays
-    obs = np.array([ob for _ in range(horizon)])
+    # these are ring buffers indexed by t % horizon and every slot is written before a
+    # segment is yielded, so allocate them directly rather than stacking horizon copies
+    obs = np.empty((horizon,) + np.shape(ob), dtype=np.asarray(ob).dtype)
     rews = np.zeros(horizon, 'float32')
     vpreds = np.zeros(horizon, 'float32')
     news = np.zeros(horizon, 'int32')
-    acs = np.array([ac for _ in range(horizon)])
-    prevacs = acs.copy()
+    acs = np.empty((horizon,) + np.shape(ac), dtype=np.asarray(ac).dtype)
+    prevacs = np.empty_like(acs)
     # define success percentage
     suc = False
     sucs = np.zeros(horizon, 'int32')
@@ -19,6 +19,10 @@ if __name__ == "__main__":
     parser.add_argument('--env', type=str, default='QuadFallingDownEnv-v0')
     parser.add_argument('--reward_type', type=str, default='ttr')
     parser.add_argument('--algo', type=str, default='ppo')
+    # the env drives a single gazebo instance, so rollouts are serial and extra TF threads only contend
+    parser.add_argument('--num_cpu', type=int, default=1)
+    # the 2x64 MLP policy is too small to benefit from the GPU; host<->device copies dominate
+    parser.add_argument('--device', type=str, default='cpu', choices=['cpu', 'gpu'])
 
     parser.add_argument('--load_path', type=str, default='None')
     parser.add_argument('--load_iter', type=int, default=0)
@@ -33,7 +37,7 @@ if __name__ == "__main__":
     env = gym.make(kwargs['env'], **kwargs)
     params = os.environ['PROJ_HOME_2']+'/ppo_params.json'
     if kwargs['algo'] == 'ppo':
-        ppo.create_session()
+        ppo.create_session(num_cpu=args.num_cpu, use_gpu=(args.device == 'gpu'))
         init_policy = ppo.create_policy('pi', env)
         ppo.initialize()
 
@@ -61,6 +65,15 @@ if __name__ == "__main__":
             gamma = d.get('gamma')
             lam = d.get('lam')
             max_iters = num_ppo_iters
+            # checkpoint every save_freq outer iterations (and always after the last one)
+            save_freq = d.get('save_freq', 1)
+
+        # Dataset.iterate_once drops a trailing partial minibatch, so a batch size that
+        # does not divide the rollout wastes the env steps collected for those samples
+        if optim_batchsize and timesteps_per_actorbatch % optim_batchsize != 0:
+            raise ValueError('optim_batchsize %d does not divide timesteps_per_actorbatch %d!!' % (optim_batchsize, timesteps_per_actorbatch))
+        if not isinstance(save_freq, int) or save_freq < 1:
+            raise ValueError('save_freq must be a positive integer, got %r!!' % (save_freq,))
             
         i = 0
         while i < num_iters:
@@ -70,7 +83,8 @@ if __name__ == "__main__":
                                                                                     optim_stepsize=optim_stepsize, optim_batchsize=optim_batchsize,
                                                                                     gamma=gamma, lam=lam, max_iters=max_iters, schedule='constant')
            
-            pi.save_model(SAVE_PATH, iteration=i)
+            if (i + 1) % save_freq == 0 or i == num_iters - 1:
+                pi.save_model(SAVE_PATH, iteration=i)
             i += 1
             
         env.close()
@@ -12,6 +12,7 @@ from gazebo_msgs.srv import ApplyBodyWrench
 from tf.transformations import euler_from_quaternion, quaternion_from_euler
 import rospy
 import time
+import math
 import numpy as np
 import sys
 import tty, termios
@@ -19,25 +20,58 @@ import tty, termios
 # distance from motor to center of quad.
 # crazyflie size: 0.092 * 0.092 * 0.029. After 10 times scale, becoming 0.92 * 0.92 *0.29
 L = 0.065
+# the motors sit on the diagonals, so each one's lever arm about the board x/y axes is L/sqrt(2)
+L_ARM = L * np.sqrt(2) / 2
+
+# same tolerance tf.transformations uses for degenerate rotations
+_EPS = np.finfo(float).eps * 4.0
+
+# rotation matrix from board frame to world frame, i.e. Rz(yaw) * Ry(pitch) * Rx(roll)
+def rotation_matrix(roll, pitch, yaw):
+	cr, sr = np.cos(roll), np.sin(roll)
+	cp, sp = np.cos(pitch), np.sin(pitch)
+	cy, sy = np.cos(yaw), np.sin(yaw)
+
+	return np.array([[cy*cp, cy*sp*sr - sy*cr, cy*sp*cr + sy*sr],
+	                 [sy*cp, sy*sp*sr + cy*cr, sy*sp*cr - cy*sr],
+	                 [-sp,   cp*sr,            cp*cr]])
 
 # coordinate transform from board frame to world frame
 def board_to_world(board_coord, roll, pitch, yaw):
 
-	Rx = np.array([[1, 0, 0],
-	               [0, np.cos(roll), -np.sin(roll)],
-								 [0, np.sin(roll), np.cos(roll)]])
-	Ry = np.array([[np.cos(pitch), 0, np.sin(pitch)],
-		             [0, 1, 0],
-								 [-np.sin(pitch), 0, np.cos(pitch)]])
-	Rz = np.array([[np.cos(yaw), -np.sin(yaw), 0],
-			           [np.sin(yaw), np.cos(yaw), 0],
-								 [0, 0, 1]])
-
-	M = np.dot(Rz, np.dot(Ry, Rx))
+	M = rotation_matrix(roll, pitch, yaw)
 	ret = np.dot(M, board_coord)
 
 	return ret
 
+# same result as tf.transformations.euler_from_quaternion (axes='sxyz'), evaluated
+# directly from the quaternion without building the 4x4 homogeneous matrix
+def quaternion_to_euler(x, y, z, w):
+	n = x*x + y*y + z*z + w*w
+	if n < _EPS:
+		return 0.0, 0.0, 0.0
+	s = 2.0 / n
+
+	m00 = 1.0 - s*(y*y + z*z)
+	m10 = s*(x*y + z*w)
+	m20 = s*(x*z - y*w)
+	m21 = s*(y*z + x*w)
+	m22 = 1.0 - s*(x*x + y*y)
+
+	cy = math.sqrt(m00*m00 + m10*m10)
+	if cy > _EPS:
+		roll = math.atan2(m21, m22)
+		pitch = math.atan2(-m20, cy)
+		yaw = math.atan2(m10, m00)
+	else:
+		m11 = 1.0 - s*(x*x + z*z)
+		m12 = s*(y*z - x*w)
+		roll = math.atan2(-m12, m11)
+		pitch = math.atan2(-m20, cy)
+		yaw = 0.0
+
+	return roll, pitch, yaw
+
 def init_quad(srv):
 	quad_state = None
 
@@ -64,31 +98,26 @@ def apply_wrench_to_quad(srv, action, roll, pitch, yaw):
 	# pitch, roll, yaw is the relative motion between two frame
 
 	# action: [UL, UR, LL, LR]
-	wrench_UL, wrench_UR, wrench_LL, wrench_LR = Wrench(), Wrench(), Wrench(), Wrench()
+	# the transform is linear, so sum the four motors' force and torque in the board frame
+	# and rotate the totals once, instead of transforming and summing one wrench per motor
+	a0, a1, a2, a3 = float(action[0]), float(action[1]), float(action[2]), float(action[3])
+	thrust = a0 + a1 + a2 + a3
+	moment_x = (a0 + a1 - a2 - a3)*L_ARM
+	moment_y = (a0 - a1 + a2 - a3)*L_ARM
 
-	# apply linear force
-	wrench_UL.force.x, wrench_UL.force.y, wrench_UL.force.z = board_to_world(np.array([0,0,action[0]]), roll=roll, pitch=pitch, yaw=yaw)
-	wrench_UR.force.x, wrench_UR.force.y, wrench_UR.force.z = board_to_world(np.array([0,0,action[1]]), roll=roll, pitch=pitch, yaw=yaw)
-	wrench_LL.force.x, wrench_LL.force.y, wrench_LL.force.z = board_to_world(np.array([0,0,action[2]]), roll=roll, pitch=pitch, yaw=yaw)
-	wrench_LR.force.x, wrench_LR.force.y, wrench_LR.force.z = board_to_world(np.array([0,0,action[3]]), roll=roll, pitch=pitch, yaw=yaw)
+	# the attitude is the same for all four motors, so build the rotation once
+	M = rotation_matrix(roll, pitch, yaw)
 
-	# apply torque
-	wrench_UL.torque.x, wrench_UL.torque.y, wrench_UL.torque.z = board_to_world(np.array([action[0]*L*np.sqrt(2)/2, action[0]*L*np.sqrt(2)/2, 0]), roll=roll, pitch=pitch, yaw=yaw)
-	wrench_UR.torque.x, wrench_UR.torque.y, wrench_UR.torque.z = board_to_world(np.array([action[1]*L*np.sqrt(2)/2, -action[1]*L*np.sqrt(2)/2, 0]), roll=roll, pitch=pitch, yaw=yaw)
-	wrench_LL.torque.x, wrench_LL.torque.y, wrench_LL.torque.z = board_to_world(np.array([-action[2]*L*np.sqrt(2)/2, action[2]*L*np.sqrt(2)/2, 0]), roll=roll, pitch=pitch, yaw=yaw)
-	wrench_LR.torque.x, wrench_LR.torque.y, wrench_LR.torque.z = board_to_world(np.array([-action[3]*L*np.sqrt(2)/2, -action[3]*L*np.sqrt(2)/2, 0]), roll=roll, pitch=pitch, yaw=yaw)
+	# in the board frame the thrust is along z only and the torque has no z part,
+	# so each world-frame vector is just a scaled column (or sum of two) of M
+	force = M[:, 2] * thrust
+	torque = M[:, 0] * moment_x + M[:, 1] * moment_y
 
-	# Actually we need combine all four motors effect into one
 	wrench = Wrench()
-	# apply to force
-	wrench.force.x = wrench_UL.force.x + wrench_UR.force.x + wrench_LL.force.x + wrench_LR.force.x
-	wrench.force.y = wrench_UL.force.y + wrench_UR.force.y + wrench_LL.force.y + wrench_LR.force.y
-	wrench.force.z = wrench_UL.force.z + wrench_UR.force.z + wrench_LL.force.z + wrench_LR.force.z
-	# apply to torque
-	wrench.torque.x = wrench_UL.torque.x + wrench_UR.torque.x + wrench_LL.torque.x + wrench_LR.torque.x
-	wrench.torque.y = wrench_UL.torque.y + wrench_UR.torque.y + wrench_LL.torque.y + wrench_LR.torque.y
-	wrench.torque.z = wrench_UL.torque.z + wrench_UR.torque.z + wrench_LL.torque.z + wrench_LR.torque.z
-
+	# apply linear force
+	wrench.force.x, wrench.force.y, wrench.force.z = force.tolist()
+	# apply torque
+	wrench.torque.x, wrench.torque.y, wrench.torque.z = torque.tolist()
 
 	srv(body_name="base_link", reference_frame="world", wrench=wrench, start_time=rospy.Time().now(), duration=rospy.Duration(1))
 